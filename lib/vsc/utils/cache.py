@@ -29,6 +29,7 @@ Caching utilities.
 @author: Andy Georges (Ghent University)
 """
 import gzip
+import json
 import os
 import time
 import pickle
@@ -37,6 +38,39 @@ import jsonpickle
 
 from vsc.utils import fancylogger
 
+# exact types only: subclasses (e.g. OrderedDict or namedtuple) do not survive a round trip through plain JSON
+_JSON_SCALARS = {str, int, float, bool, type(None)}
+_JSON_LISTS = {list}
+_JSON_DICTS = {dict}
+_JSON_KEYS = {str}
+_SHELF_VALUES = {tuple}
+
+
+def _is_json_key(key):
+    """Check if the key is a string that jsonpickle will not mistake for one of its tags."""
+    return type(key) in _JSON_KEYS and not key.startswith('py/')
+
+
+def _is_json_native(data):
+    """Check if the data comes back unchanged from a round trip through plain JSON.
+
+    Dict keys that look like jsonpickle tags are refused, so jsonpickle can read the result as well.
+    """
+    if type(data) in _JSON_SCALARS:
+        return True
+    if type(data) in _JSON_LISTS:
+        return all(_is_json_native(item) for item in data)
+    if type(data) in _JSON_DICTS:
+        return all(_is_json_key(key) and _is_json_native(value) for (key, value) in data.items())
+    return False
+
+
+def _is_json_shelf(shelf):
+    """Check if all keys and (timestamp, data) values of the shelf can be stored as plain JSON."""
+    return all(_is_json_key(key) and type(value) in _SHELF_VALUES and all(_is_json_native(item) for item in value)
+               for (key, value) in shelf.items())
+
+
 class FileCache:
     """File cache with a timestamp safety.
 
@@ -55,7 +89,7 @@ class FileCache:
     _not_ written to the file.
     """
 
-    def __init__(self, filename, retain_old=True, raise_unpickable=False):
+    def __init__(self, filename, retain_old=True, raise_unpickable=False, compresslevel=1, fileobj=None):
         """Initializer.
 
         Checks if the file can be accessed and load the data therein if any. If the file does not yet exist, start
@@ -63,13 +97,21 @@ class FileCache:
         The file is closed after reading the data.
 
         @type filename: string
+        @type compresslevel: int
+        @type fileobj: binary file-like object
 
         @param filename: (absolute) path to the cache file.
+        @param compresslevel: gzip compression level (1-9) used when storing the cache file. The cached data is
+                              usually small, so the fastest level is the default.
+        @param fileobj: read the cache from and store it to this (seekable) file object instead of the file
+                        at filename, which is then only used in log messages.
         """
 
         self.log = fancylogger.getLogger(self.__class__.__name__, fname=False)
         self.filename = filename
+        self.fileobj = fileobj
         self.retain_old = retain_old
+        self.compresslevel = compresslevel
 
         self.new_shelf = {}
         if not retain_old:
@@ -78,33 +120,36 @@ class FileCache:
             return
 
         try:
-            with open(self.filename, 'rb') as f:
+            if fileobj is None:
+                with open(self.filename, 'rb') as f:
+                    data = f.read()
+            else:
+                data = fileobj.read()
+            try:
+                s = gzip.decompress(data)
+            except OSError:
+                self.log.error("Cannot load data from cache file %s as gzipped json", self.filename)
                 try:
-                    g = gzip.GzipFile(mode='rb', fileobj=f)  # no context manager available in python 26 yet
-                    s = g.read()
-                except (OSError) as _:
-                    self.log.error("Cannot load data from cache file %s as gzipped json", self.filename)
-                    try:
-                        f.seek(0)
-                        self.shelf = pickle.load(f)
-                    except pickle.UnpicklingError as err:
-                        msg = f"Problem loading pickle data from {self.filename} (corrupt data)"
-                        if raise_unpickable:
-                            self.log.raiseException(msg)
-                        else:
-                            self.log.error("%s. Continue with empty shelf: %s", msg, err)
-                            self.shelf = {}
-                    except OSError:
-                        self.log.raiseException("Could not load pickle data from %s", self.filename)
-                else:
-                    try:
-                        self.shelf = jsonpickle.decode(s)
-                    except ValueError as err:
-                        self.log.error("Cannot decode JSON from %s [%s]", self.filename, err)
-                        self.log.info("Cache in %s starts with an empty shelf", self.filename)
+                    self.shelf = pickle.loads(data)
+                except pickle.UnpicklingError as err:
+                    msg = f"Problem loading pickle data from {self.filename} (corrupt data)"
+                    if raise_unpickable:
+                        self.log.raiseException(msg)
+                    else:
+                        self.log.error("%s. Continue with empty shelf: %s", msg, err)
                         self.shelf = {}
-                finally:
-                    g.close()
+            else:
+                try:
+                    shelf = json.loads(s)
+                    if isinstance(shelf, dict) and all(type(value) in _JSON_LISTS for value in shelf.values()):
+                        # plain JSON shelf, jsonpickle would have stored the values as tagged tuples
+                        self.shelf = {key: tuple(value) for key, value in shelf.items()}
+                    else:
+                        self.shelf = jsonpickle.decode(s)
+                except ValueError as err:
+                    self.log.error("Cannot decode JSON from %s [%s]", self.filename, err)
+                    self.log.info("Cache in %s starts with an empty shelf", self.filename)
+                    self.shelf = {}
 
         except (OSError, ValueError, FileNotFoundError) as err:
             self.log.warning("Could not access the file cache at %s [%s]", self.filename, err)
@@ -122,7 +167,24 @@ class FileCache:
         @param data: whatever needs to be stored
         @param threshold: time in seconds
         """
+        return self._update(key, data, threshold, time.time())
+
+    def update_many(self, items, threshold):
+        """Update the data for several keys at once, using a single timestamp.
+
+        @type items: dict
+        @type threshold: int
+
+        @param items: data to store, indexed by key
+        @param threshold: time in seconds
+
+        @returns: list of keys for which the data was updated
+        """
         now = time.time()
+        return [key for (key, data) in items.items() if self._update(key, data, threshold, now)]
+
+    def _update(self, key, data, threshold, now):
+        """Update the given data at time now if the existing data is older than the given threshold."""
         old = self.load(key)
         if old:
             (ts, _) = old
@@ -161,22 +223,29 @@ class FileCache:
 
     def close(self):
         """Close the cache."""
-        dirname = os.path.dirname(self.filename)
-        if not os.path.exists(dirname):
-            os.makedirs(dirname)
-        with open(self.filename, 'wb') as fih:
-            if not fih:
-                self.log.error('cannot open the file cache at %s for writing', self.filename)
-            else:
-                if self.retain_old:
-                    if self.shelf is None:
-                        self.shelf = {}
-                    self.shelf.update(self.new_shelf)
-                    self.new_shelf = self.shelf
-
-                with gzip.GzipFile(mode='wb', fileobj=fih) as zipf:
-                    pickled = jsonpickle.encode(self.new_shelf)
-                    # .encode() is required in Python 3, since we need to pass a bytestring
-                    zipf.write(pickled.encode())
+        if self.retain_old:
+            if self.shelf is None:
+                self.shelf = {}
+            self.shelf.update(self.new_shelf)
+            self.new_shelf = self.shelf
+
+        if _is_json_shelf(self.new_shelf):
+            # much faster than jsonpickle, and the result can still be decoded by it
+            pickled = json.dumps(self.new_shelf)
+        else:
+            pickled = jsonpickle.encode(self.new_shelf)
+        # .encode() is required in Python 3, since we need to pass a bytestring
+        zipped = gzip.compress(pickled.encode(), compresslevel=self.compresslevel)
+
+        if self.fileobj is None:
+            dirname = os.path.dirname(self.filename)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            with open(self.filename, 'wb') as fih:
+                fih.write(zipped)
+        else:
+            self.fileobj.seek(0)
+            self.fileobj.truncate()
+            self.fileobj.write(zipped)
 
-                self.log.info('closing the file cache at %s', self.filename)
+        self.log.info('closing the file cache at %s', self.filename)
@@ -303,7 +303,7 @@ class NagiosReporter:
         @param nagios_message: the message to print out when the actual check runs.
         """
         try:
-            nagios_cache = FileCache(self.filename)
+            nagios_cache = FileCache(self.filename, False)  # the previous result is overwritten anyway
             nagios_cache.update('nagios', (nagios_exit, nagios_message), 0)  # always update
             nagios_cache.close()
             self.log.info("Wrote nagios check cache file %s at about %s", self.filename, time.ctime(time.time()))
@@ -31,7 +31,9 @@ moved here from vsc-ldap vsc.ldap.timestamp
 """
 
 import datetime
+import functools
 import logging
+import re
 
 from vsc.utils.cache import FileCache
 from vsc.utils.dateandtime import utc
@@ -40,6 +42,11 @@ LDAP_DATETIME_TIMEFORMAT = "%Y%m%d%H%M%SZ"
 
 DEFAULT_TIMESTAMP = "20140101000000Z"
 
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=utc)
+
+# YYYYMMDD, YYYYMMDDHHMM or YYYYMMDDHHMMSSZ (LDAP_DATETIME_TIMEFORMAT)
+TIMESTAMP_REGEX = re.compile(r"(\d{4})(\d{2})(\d{2})(?:(\d{2})(\d{2})(?:(\d{2})Z)?)?", re.ASCII)
+
 
 def convert_to_datetime(timestamp=None):
     """
@@ -65,30 +72,37 @@ def convert_to_datetime(timestamp=None):
         if timestamp.tzinfo is None:
             timestamp = timestamp.replace(tzinfo=utc)
     elif isinstance(timestamp, str):
-        if len(timestamp) == 10:
-            # Unix timestamp
-            timestamp = datetime.datetime.fromtimestamp(int(timestamp), utc)
-        else:
-            if len(timestamp) == 12:
-                date_format = "%Y%m%d%H%M"
-            elif len(timestamp) == 15:  # len(LDAP_DATETIME_FORMAT doesn't work here
-                date_format = LDAP_DATETIME_TIMEFORMAT
-            elif len(timestamp) == 8:
-                date_format = "%Y%m%d"
-            else:
-                raise ValueError(f"invalid format provided {timestamp}")
-            timestamp = datetime.datetime.strptime(timestamp, date_format)
+        return _convert_string_to_datetime(timestamp)
 
     return timestamp.replace(tzinfo=utc)
 
 
+@functools.lru_cache(maxsize=1024)
+def _convert_string_to_datetime(timestamp):
+    """
+    Parse a timestamp string (see convert_to_datetime) to a datetime.datetime with UTC tzinfo
+
+    The results are cached, since the same few timestamps tend to be converted over and over.
+    """
+    if len(timestamp) == 10:
+        # Unix timestamp
+        return datetime.datetime.fromtimestamp(int(timestamp), utc)
+
+    # a single match is much cheaper than strptime, which goes through its own regex and locale handling
+    match = TIMESTAMP_REGEX.fullmatch(timestamp)
+    if match is None:
+        raise ValueError(f"invalid format provided {timestamp}")
+
+    return datetime.datetime(*(int(field) for field in match.groups(0)), tzinfo=utc)
+
+
 def convert_to_unix_timestamp(timestamp=None):
     """
     Convert a string or datetime.datetime instance
     to an integer representing unix timestamp (seconds since epoch)
     """
     timestamp = convert_to_datetime(timestamp)
-    return int((timestamp - datetime.datetime(1970, 1, 1, tzinfo=utc)).total_seconds())
+    return int((timestamp - EPOCH).total_seconds())
 
 
 def convert_timestamp(timestamp=None):
@@ -146,16 +160,39 @@ def retrieve_timestamp_with_default(filename, start_timestamp=None, default_time
     - the current time (datetime instance) based on the given delta (offset compared to now(tz=utc) in seconds),
       defaulting to -10s.
     """
-    timestamp = start_timestamp
-    if start_timestamp is None:
-        timestamp = read_timestamp(filename)
+    (timestamps, current_time) = retrieve_timestamps_with_default(
+        [filename],
+        start_timestamp=start_timestamp,
+        default_timestamp=default_timestamp,
+        delta=delta,
+    )
+    return (timestamps[filename], current_time)
 
-    if timestamp is None:
-        timestamp = convert_to_unix_timestamp(default_timestamp)
-    else:
-        timestamp = convert_to_unix_timestamp(timestamp)
 
-    logging.info("Using timestamp %s", timestamp)
+def retrieve_timestamps_with_default(filenames, start_timestamp=None, default_timestamp=DEFAULT_TIMESTAMP, delta=-10):
+    """
+    Batched version of retrieve_timestamp_with_default.
+
+    Return a tuple consisting of the following values:
+    - a dict mapping each of the given filenames to its unix timestamp (see retrieve_timestamp_with_default)
+    - the current time (datetime instance) based on the given delta, shared by all files
+    """
+    default = None
+    timestamps = {}
+    for filename in filenames:
+        timestamp = start_timestamp
+        if start_timestamp is None:
+            timestamp = read_timestamp(filename)
+
+        if timestamp is None:
+            if default is None:
+                default = convert_to_unix_timestamp(default_timestamp)
+            timestamp = default
+        else:
+            timestamp = convert_to_unix_timestamp(timestamp)
+
+        logging.info("Using timestamp %s for %s", timestamp, filename)
+        timestamps[filename] = timestamp
 
     current_time = datetime.datetime.now(tz=utc) + datetime.timedelta(seconds=delta)
-    return (timestamp, current_time)
+    return (timestamps, current_time)
@@ -27,7 +27,6 @@
 Several lockfile strategies for VSC tools that will be running.
 
 Implementation based on the PIDLockFile of http://pypi.python.org/pypi/lockfile.
-The above is available for Python 2.4, if a diff is applied.
 
 @author: Andy Georges (Ghent University)
 """
@@ -37,7 +36,15 @@ import os
 import signal
 import time
 
-from lockfile.linklockfile import LockBase, LockFailed, NotLocked, NotMyLock
+from lockfile.linklockfile import AlreadyLocked, LockBase, LockFailed, NotLocked, NotMyLock
+
+# delays (in seconds) between the attempts to obtain a lock that is held by someone else
+RETRY_DELAY_START = 0.01
+RETRY_DELAY_MAX = 1.0
+
+# (PID, start time) of the current process, looked up again when the PID changes (i.e., after a fork)
+_PROCESS_INFO = (None, None)
+
 
 class LockFileReadError(Exception):
     '''Exception raised when we cannot get the expected information from the lock file.'''
@@ -46,10 +53,17 @@ class LockFileReadError(Exception):
 class TimestampedPidLockfile(LockBase):
     '''Basic lock file implementation.'''
 
-    def __init__(self, path, threshold=60):
-        '''Intializer.'''
+    def __init__(self, path, threshold=60, retry_timeout=1, kill_obsolete=False):
+        '''Intializer.
+
+        @param threshold: age (in seconds) after which an existing lockfile is considered obsolete
+        @param retry_timeout: time (in seconds) to keep retrying when the lock is held by someone else
+        @param kill_obsolete: send SIGHUP to the process still holding an obsolete lock before taking it over
+        '''
         LockBase.__init__(self, path, False)
         self.threshold = threshold
+        self.retry_timeout = retry_timeout
+        self.kill_obsolete = kill_obsolete
 
     def read_pid_timestamp(self):
         '''Obtain the PID and timestamp from the lockfile.
@@ -60,12 +74,13 @@ class TimestampedPidLockfile(LockBase):
 
     def is_locked(self):
         '''We are locked if the lockfile exists.'''
-        return os.path.exists(self.path)
+        return _stat_or_none(self.path) is not None
 
     def i_am_locking(self):
         '''We are locking if our PID is stored in the lockfile.'''
-        if self.is_locked():
-            (pid, _) = _read_pid_timestamp_file(self.path)
+        pid_timestamp = _read_pid_timestamp_file(self.path)
+        if pid_timestamp is not None:
+            (pid, _) = pid_timestamp
             return pid == os.getpid()
         return False
 
@@ -73,31 +88,77 @@ class TimestampedPidLockfile(LockBase):
         '''Obtains the lock, storing its own PID and the timestamp
         at which the lock was obtained in the lockfile.
 
+        When the lock is held by someone else, retry with an exponential back-off
+        for at most retry_timeout seconds (capped at the threshold). Other errors
+        (e.g., a missing or read-only directory) are not retried.
+
         Raises a LockFailed exception when the lock cannot be obtained.
         '''
         if not timeout:
             timeout = self.threshold
+        deadline = time.monotonic() + min(self.retry_timeout, timeout)
+        delay = RETRY_DELAY_START
+        while True:
+            try:
+                self._acquire_once(timeout)
+                break
+            except AlreadyLocked as err:
+                if time.monotonic() + delay > deadline:
+                    logging.error('Unable to obtain lock on %s: %s', self.path, err)
+                    raise LockFailed(err) from err
+            except LockFailed as err:
+                logging.error('Unable to obtain lock on %s: %s', self.path, err)
+                raise
+            time.sleep(delay)
+            delay = min(delay * 2, RETRY_DELAY_MAX)
+        logging.info('Obtained lock on timestamped pid lockfile %s', self.path)
+
+    def _acquire_once(self, timeout):
+        '''Make a single attempt to obtain the lock, breaking it when it is older than timeout seconds.
+
+        Raises an AlreadyLocked exception when the lock is held by someone else,
+        and a LockFailed exception when the lock cannot be obtained for any other reason.
+        '''
         try:
             _write_pid_timestamp_file(self.path)
-            logging.info('Obtained lock on timestamped pid lockfile %s', self.path)
-        except (OSError, FileNotFoundError, FileExistsError) as err:
-            doraise = True
-            if err.errno == errno.EEXIST:
-                ## Check if the timestamp is older than the threshold
-                (pid, timestamp) = _read_pid_timestamp_file(self.path)
-                if time.time() - timestamp > timeout:
-                    _find_and_kill(pid)
-                    os.unlink(self.path)
-                    logging.warning('Obsolete lockfile detected at %s: pid = %d, timestamp = %s',
-                                    self.path, pid, time.ctime(timestamp))
-                    try:
-                        _write_pid_timestamp_file(self.path)
-                        doraise = False
-                    except Exception:
-                        pass
-            if doraise:
-                logging.error('Unable to obtain lock on %s: %s', self.path, err)
-                raise LockFailed
+            return
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise LockFailed(err)
+            held = err
+
+        ## Check if the lockfile is older than the threshold
+        # mtime and contents are taken from the same open file, so they belong to the same lock
+        lockstate = _stat_and_read_lockfile(self.path)
+        if lockstate is None:
+            # released in the meantime
+            raise AlreadyLocked(held)
+        (lockstat, lockinfo) = lockstate
+        # mtime is set from the wall clock, so compare it against the wall clock
+        if time.time() - lockstat.st_mtime <= timeout:
+            raise AlreadyLocked(held)
+
+        if not _same_file(self.path, lockstat):
+            # someone else broke the obsolete lock and took it in the meantime
+            raise AlreadyLocked(held)
+
+        if lockinfo is None:
+            logging.warning('Obsolete lockfile with invalid contents detected at %s: timestamp = %s',
+                            self.path, time.ctime(lockstat.st_mtime))
+        else:
+            (pid, _, starttime) = lockinfo
+            if self.kill_obsolete and _pid_alive(pid, starttime):
+                _find_and_kill(pid)
+            logging.warning('Obsolete lockfile detected at %s: pid = %d, timestamp = %s',
+                            self.path, pid, time.ctime(lockstat.st_mtime))
+        try:
+            os.unlink(self.path)
+            _write_pid_timestamp_file(self.path)
+        except (FileNotFoundError, FileExistsError) as err:
+            # someone else broke the obsolete lock first
+            raise AlreadyLocked(err)
+        except OSError as err:
+            raise LockFailed(err)
 
     def release(self):
         '''Release the lock.
@@ -113,6 +174,30 @@ class TimestampedPidLockfile(LockBase):
         os.remove(self.path)
 
 
+def _stat_or_none(path):
+    '''Stat the given path.
+
+    Returns the os.stat_result, or None if the path does not exist.
+    '''
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+
+def _same_file(path, lockstat):
+    '''Check if path still refers to the file with the given os.stat_result.
+
+    The inode number alone is not enough, a new lockfile can get the inode of the one it replaced.
+    Its mtime can not match though: the replaced lock was obsolete, the new one is fresh.
+    '''
+    pathstat = _stat_or_none(path)
+    if pathstat is None:
+        return False
+    return ((pathstat.st_dev, pathstat.st_ino, pathstat.st_mtime_ns) ==
+            (lockstat.st_dev, lockstat.st_ino, lockstat.st_mtime_ns))
+
+
 def _read_pid_timestamp_file(path):
     '''Get the PID and the timestamp from the file.
     This information is stored in plaintext on two separate lines.
@@ -121,42 +206,131 @@ def _read_pid_timestamp_file(path):
 
     Returns (pid :: Int, timestamp :: Int).
     '''
+    lockinfo = _read_lockfile(path)
+    if lockinfo is None:
+        return None
+    return lockinfo[:2]
+
+
+def _read_lockfile(path):
+    '''Get the PID, the timestamp and the process start time from the file.
+    The start time is stored on an optional third line, lockfiles written by
+    older versions do not have it.
+
+    @type path: string corresponding to an (absolute) path to a file.
+
+    Returns (pid :: Int, timestamp :: Int, starttime :: Int or None).
+    '''
     try:
         with open(path, encoding='utf8') as pidfp:
-            pidline = pidfp.readline().strip()
-            timestampline = pidfp.readline().strip()
-            pid = int(pidline)
-            timestamp = int(timestampline)
-            return (pid, timestamp)
+            return _parse_lockfile(pidfp.read(64), path)
 
     except OSError as err:
         if err.errno == errno.ENOENT:
             return None
         else:
             raise LockFileReadError('Cannot get the information from the pid file.')
+
+
+def _stat_and_read_lockfile(path):
+    '''Stat the file and get its contents through a single open file descriptor.
+
+    Returns a tuple (os.stat_result, (pid, timestamp, starttime)) or None if the file does not exist.
+    The second element is None if the contents are invalid, e.g., when the file is still being written.
+    Raises a LockFileReadError when the file cannot be read.
+    '''
+    try:
+        with open(path, encoding='utf8') as pidfp:
+            lockstat = os.fstat(pidfp.fileno())
+            data = pidfp.read(64)
+    except OSError as err:
+        if err.errno == errno.ENOENT:
+            return None
+        else:
+            raise LockFileReadError('Cannot get the information from the pid file.')
+    try:
+        return (lockstat, _parse_lockfile(data, path))
+    except LockFileReadError:
+        return (lockstat, None)
+
+
+def _parse_lockfile(data, path):
+    '''Parse the contents of the lockfile at path into (pid, timestamp, starttime).'''
+    try:
+        fields = data.split(None, 3)
+        (pidline, timestampline) = fields[:2]
+        pid = int(pidline)
+        timestamp = int(timestampline)
+        starttime = int(fields[2]) if len(fields) > 2 else None
+        return (pid, timestamp, starttime)
     except ValueError:
         raise LockFileReadError(f"Contents of pid file {path} invalid")
 
 
 def _write_pid_timestamp_file(path):
-    '''Write the PID and timestamp to the file.
+    '''Write the PID, the timestamp and (when available) the process start time to the file.
 
     @type path: string corresponding to an (absolute) path to a file.
     '''
     pidfp = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
-    pidfile = os.fdopen(pidfp, 'w')
-    pidfile.write(f"{os.getpid()}\n{int(int(time.time()))}\n")
-    pidfile.flush()
-    pidfile.close()
+    # no fsync: the lock is only meaningful for running processes, it need not survive a crash
+    (pid, starttime) = _process_info()
+    with os.fdopen(pidfp, 'w') as pidfile:
+        pidfile.write(f"{pid}\n{int(time.time())}\n")
+        if starttime is not None:
+            pidfile.write(f"{starttime}\n")
+
+
+def _proc_starttime(pid):
+    '''Get the start time of the process with the given PID, in clock ticks since boot.
+
+    Returns None if there is no such process (or no /proc to look it up).
+    '''
+    try:
+        with open(f"/proc/{pid}/stat", encoding='utf8') as statfp:
+            stat = statfp.read()
+    except OSError:
+        return None
+    # the command name (2nd field) may contain spaces and parentheses, the start time is the 22nd field
+    return int(stat.rsplit(')', 1)[1].split()[19])
+
+
+def _pid_alive(pid, expected_starttime=None):
+    '''Check if the process with the given PID is still running.
+
+    If the expected start time is given, a process with a different start time
+    is a new process that reused the PID, and is not considered to be alive.
+    '''
+    starttime = _proc_starttime(pid)
+    if starttime is None:
+        return False
+    return expected_starttime is None or starttime == expected_starttime
 
 
 def _find_and_kill(pid):
     '''See if the process corresponding to the given PID is still running. If so,
     kill it (gently).
+
+    Returns True if the process was signalled, False otherwise.
+    '''
+    try:
+        os.kill(pid, signal.SIGHUP)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        logging.warning('Not allowed to kill process with pid %d', pid)
+        return False
+    return True
+
+
+def _process_info():
+    '''Get the PID and the start time of the current process.
+
+    The start time is only read from /proc once per process: the cached value is
+    compared against os.getpid(), so a forked child looks up its own.
     '''
-    for psline in os.popen('ps ax'):
-        fields = psline.split()
-        if fields[0] == pid:
-            os.kill(pid, signal.SIGHUP)
-            return True
-    return False
+    global _PROCESS_INFO
+    pid = os.getpid()
+    if _PROCESS_INFO[0] != pid:
+        _PROCESS_INFO = (pid, _proc_starttime(pid))
+    return _PROCESS_INFO
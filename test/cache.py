@@ -30,13 +30,14 @@ Unit tests for vsc.utils.cache
 """
 
 import gzip
+import io
+import json
 import os
-import tempfile
 import time
-import shutil
 import sys
 import random
 import mock
+import jsonpickle
 
 from vsc.install.testing import TestCase
 from vsc.utils.cache import FileCache
@@ -47,87 +48,142 @@ LIST_LEN = 30  # same as in paycheck
 def get_rand_data():
     """Returns a random dict with between 0 and LIST_LEN elements  and a random threshold"""
     length = random.randint(0, LIST_LEN)
-    data = {}
-    for _ in range(length):
-        data[random.randint(0, sys.maxsize)] = random.randint(0, sys.maxsize)
+    keys = random.sample(range(sys.maxsize), length)
+    values = random.choices(range(sys.maxsize), k=length)
+    data = dict(zip(keys, values))
     threshold = random.randint(0, sys.maxsize)
     return data, threshold
 
 
 class TestCache(TestCase):
+    def setUp(self):
+        """Pick a cache filename for this test"""
+        super().setUp()
+        self.filename = os.path.join(self.tmpdir, self._testMethodName)
+
     def test_contents(self):
         """Check that the contents of the cache is what is expected prior to closing it."""
         # test with random data
         data, threshold = get_rand_data()
 
-        # create a tempfilename
-        (handle, filename) = tempfile.mkstemp(dir='/tmp')
-        os.unlink(filename)
-        os.close(handle)
-        cache = FileCache(filename)
-        for (key, value) in data.items():
-            cache.update(key, value, threshold)
+        cache = FileCache(self.filename)
+        cache.update_many(data, threshold)
 
         now = time.time()
         for key, content in data.items():
             info = cache.load(key)
-            self.assertFalse(info is None)
+            self.assertIsNotNone(info)
             (ts, value) = info
-            self.assertTrue(value == content)
-            self.assertTrue(ts <= now)
+            self.assertEqual(value, content)
+            self.assertLessEqual(ts, now)
 
     def test_save_and_load(self):
         """Check if the loaded data is the same as the saved data."""
         # test with random data
         data, threshold = get_rand_data()
-        tempdir = tempfile.mkdtemp()
-        # create a tempfilename
-        (handle, filename) = tempfile.mkstemp(dir=tempdir)
-        os.close(handle)
-        shutil.rmtree(tempdir)
+        # the directory of the cache file is created when closing the cache
+        filename = os.path.join(self.tmpdir, 'missing', 'cache')
         cache = FileCache(filename)
-        for (key, value) in data.items():
-            cache.update(key, value, threshold)
+        cache.update_many(data, threshold)
         cache.close()
 
         now = time.time()
         new_cache = FileCache(filename)
         for key, content in data.items():
-            info = cache.load(key)
-            self.assertTrue(info is not None)
+            # dict keys are stored as strings in the cache file
+            info = new_cache.load(str(key))
+            self.assertIsNotNone(info)
             (ts, value) = info
-            self.assertTrue(value == content)
-            self.assertTrue(ts <= now)
+            self.assertEqual(value, content)
+            self.assertLessEqual(ts, now)
+        new_cache.close()
+
+    def test_compresslevel(self):
+        """Check that the compression level is applied and the cache file can be read back regardless."""
+        # compressible enough for level 9 to beat level 1
+        data = {f"key{i}": [i, i % 7, 'value'] for i in range(1000)}
+        sizes = {}
+        for compresslevel in (1, 9):
+            cache = FileCache(self.filename, compresslevel=compresslevel)
+            cache.update_many(data, 0)
+            cache.close()
+            sizes[compresslevel] = os.path.getsize(self.filename)
+
+            new_cache = FileCache(self.filename)
+            for key, content in data.items():
+                (_, value) = new_cache.load(key)
+                self.assertEqual(value, content)
+            os.unlink(self.filename)
+
+        self.assertLess(sizes[9], sizes[1])
+
+    def test_json_shelf(self):
+        """Check that plain data is stored as JSON and everything else through jsonpickle."""
+        plain = {'a': [1, 2.5, None, True], 'b': {'c': 'd'}}
+        cache = FileCache(self.filename)
+        cache.update('plain', plain, 0)
+        cache.update('string', 'x', 0)
+        cache.close()
+
+        with gzip.open(self.filename, 'rb') as zipf:
+            contents = zipf.read()
+        self.assertNotIn(b'py/', contents)
+        self.assertEqual(json.loads(contents)['plain'][1], plain)
+        # older versions only decode with jsonpickle
+        self.assertEqual(jsonpickle.decode(contents)['plain'][1], plain)
+
+        new_cache = FileCache(self.filename)
+        self.assertEqual(new_cache.load('plain')[1], plain)
+        self.assertIsInstance(new_cache.load('plain'), tuple)
+        self.assertEqual(new_cache.load('string')[1], 'x')
+
+        new_cache.update('tuple', (1, 'OK'), 0)
         new_cache.close()
 
-        shutil.rmtree(tempdir)
+        with gzip.open(self.filename, 'rb') as zipf:
+            contents = zipf.read()
+        self.assertIn(b'py/tuple', contents)
+
+        new_cache = FileCache(self.filename)
+        self.assertEqual(new_cache.load('plain')[1], plain)
+        self.assertEqual(new_cache.load('tuple')[1], (1, 'OK'))
+
+    def test_update_many(self):
+        """Check that update_many only replaces data older than the threshold."""
+        cache = FileCache(self.filename)
+        self.assertEqual(cache.update_many({'a': 1, 'b': 2}, 0), ['a', 'b'])
+        (ts_a, _) = cache.load('a')
+        self.assertEqual(cache.load('b'), (ts_a, 2))
+
+        self.assertEqual(cache.update_many({'a': 3, 'c': 4}, 3600), ['c'])
+        self.assertEqual(cache.load('a'), (ts_a, 1))
+        self.assertEqual(cache.load('c')[1], 4)
+
+    def test_fileobj(self):
+        """Check storing the cache in a file object."""
+        data, threshold = get_rand_data()
+        buf = io.BytesIO()
+        cache = FileCache(self.filename, fileobj=buf)
+        cache.update_many(data, threshold)
+        cache.close()
+        self.assertFalse(os.path.exists(self.filename))
+
+        buf.seek(0)
+        new_cache = FileCache(self.filename, fileobj=buf)
+        for key, content in data.items():
+            self.assertEqual(new_cache.load(str(key))[1], content)
 
     def test_corrupt_gz_cache(self):
         """Test to see if we can handle a corrupt cache file"""
-        tempdir = tempfile.mkdtemp()
-        # create a tempfilename
-        (handle, filename) = tempfile.mkstemp(dir=tempdir)
-        f = os.fdopen(handle, 'w')
-        f.write('blabla;not gz')
-        f.close()
-        FileCache(filename)
-        shutil.rmtree(tempdir)
-
-    @mock.patch('vsc.utils.cache.jsonpickle.decode')
-    def test_value_error(self, mock_decode):
-        "Test to see that a ValueError upon decoding gets caught correctly"
-        tempdir = tempfile.mkdtemp()
-        # create a tempfilename
-        (handle, filename) = tempfile.mkstemp(dir=tempdir)
-        f = os.fdopen(handle, 'wb')
-        g = gzip.GzipFile(mode='wb', fileobj=f)
-        g.write(b'blabla no json gzip stuffz')
-        g.close()
+        fc = FileCache(self.filename, fileobj=io.BytesIO(b'blabla;not gz'))
+        self.assertEqual(fc.shelf, {})
 
-        e = ValueError('unable to find valid JSON')
-        mock_decode.side_effect = e
+    @mock.patch.object(jsonpickle, 'decode', side_effect=ValueError('unable to find valid JSON'))
+    def test_value_error(self, _):
+        "Test to see that a ValueError upon decoding gets caught correctly"
+        # valid JSON, but not a plain shelf, so it is handed to jsonpickle
+        buf = io.BytesIO(gzip.compress(b'["blabla no json gzip stuffz"]'))
 
-        fc = FileCache(filename)
+        fc = FileCache(self.filename, fileobj=buf)
 
-        self.assertTrue(fc.shelf == {})
-        shutil.rmtree(tempdir)
+        self.assertEqual(fc.shelf, {})
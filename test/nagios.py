@@ -29,26 +29,28 @@ Tests for the vsc.utils.nagios module.
 @author: Andy Georges (Ghent University)
 """
 import os
-import tempfile
 import time
-import sys
 import random
 import string
 from pwd import getpwuid
-from io import StringIO
+
+import mock
 
 from vsc.install.testing import TestCase
 
 from vsc.utils.nagios import NagiosReporter, SimpleNagios
 from vsc.utils.nagios import NAGIOS_EXIT_OK, NAGIOS_EXIT_WARNING, NAGIOS_EXIT_CRITICAL, NAGIOS_EXIT_UNKNOWN
 
+NAGIOS_USER = getpwuid(os.getuid()).pw_name
+# fixed seed, so test_cache is reproducible
+CACHE_MESSAGE = ''.join(random.Random(42).choices(string.printable, k=30)).rstrip()
+
 
 class TestNagios(TestCase):
     """Test for the nagios reporter class."""
 
     def setUp(self):
-        user = getpwuid(os.getuid())
-        self.nagios_user = user.pw_name
+        self.nagios_user = NAGIOS_USER
         super().setUp()
 
     def test_eval(self):
@@ -64,37 +66,25 @@ class TestNagios(TestCase):
 
     def test_cache(self):
         """Test the caching mechanism in the reporter."""
-        length = random.randint(1, 30)
-        exit_code = random.randint(0, 3)
-        threshold = random.randint(0, 10)
+        threshold = 10
+        message = CACHE_MESSAGE
 
-        message = ''.join(random.choice(string.printable) for x in range(length))
-        message = message.rstrip()
+        filename = os.path.join(self.tmpdir, self._testMethodName)
 
-        (handle, filename) = tempfile.mkstemp()
-        os.unlink(filename)
-        os.close(handle)
-        reporter = NagiosReporter('test_cache', filename, threshold, self.nagios_user)
-
-        nagios_exit = [NAGIOS_EXIT_OK, NAGIOS_EXIT_WARNING, NAGIOS_EXIT_CRITICAL, NAGIOS_EXIT_UNKNOWN][exit_code]
+        for nagios_exit in [NAGIOS_EXIT_OK, NAGIOS_EXIT_WARNING, NAGIOS_EXIT_CRITICAL, NAGIOS_EXIT_UNKNOWN]:
+            with self.subTest(nagios_exit=nagios_exit[1]):
+                reporter = NagiosReporter('test_cache', filename, threshold, self.nagios_user)
+                reporter.cache(nagios_exit, message)
 
-        reporter.cache(nagios_exit, message)
+                self.mock_stdout(True)
+                with self.assertRaises(SystemExit) as cm:
+                    reporter_test = NagiosReporter('test_cache', filename, threshold, self.nagios_user)
+                    reporter_test.report_and_exit()
+                stdout = self.get_stdout().rstrip()
+                self.mock_stdout(False)
 
-        (handle, _) = tempfile.mkstemp()
-        os.close(handle)
-
-        old_stdout = sys.stdout
-        try:
-            buffer = StringIO()
-            sys.stdout = buffer
-            reporter_test = NagiosReporter('test_cache', filename, threshold, self.nagios_user)
-            reporter_test.report_and_exit()
-        except SystemExit as err:
-            line = buffer.getvalue().rstrip()
-            sys.stdout = old_stdout
-            buffer.close()
-            self.assertTrue(err.code == nagios_exit[0])
-            self.assertTrue(line == f"{nagios_exit[1]} {message}")
+                self.assertEqual(cm.exception.code, nagios_exit[0])
+                self.assertEqual(stdout, f"{nagios_exit[1]} {message}")
 
         os.unlink(filename)
 
@@ -105,52 +95,31 @@ class TestNagios(TestCase):
         if message == '':
             return
 
-        (handle, filename) = tempfile.mkstemp()
-        os.unlink(filename)
+        filename = os.path.join(self.tmpdir, self._testMethodName)
         reporter = NagiosReporter('test_cache', filename, threshold, self.nagios_user)
 
-        # redirect stdout
-        old_stdout = sys.stdout
-        buff = StringIO()
-        sys.stdout = buff
-
         nagios_exit = NAGIOS_EXIT_OK
-        reporter.cache(nagios_exit, message)
-        os.close(handle)
-
-        raised_exception = None
-        try:
-            reporter_test = NagiosReporter('test_cache', filename, threshold, self.nagios_user)
-            reporter_test.report_and_exit()
-        except SystemExit as err:
-            raised_exception = err
-        self.assertEqual(raised_exception.code, NAGIOS_EXIT_OK[0],
+        self.mock_stdout(True)
+        with self.assertRaises(SystemExit) as cm:
+            reporter.cache(nagios_exit, message)
+            reporter.report_and_exit()
+        self.mock_stdout(False)
+        self.assertEqual(cm.exception.code, NAGIOS_EXIT_OK[0],
                          "Exit with status when the cached data is recent")
-        # restore stdout
-        buff.close()
-        sys.stdout = old_stdout
 
-        reporter = NagiosReporter('test_cache', filename, threshold, self.nagios_user)
         reporter.cache(nagios_exit, message)
-        time.sleep(threshold + 1)
-        # redirect stdout
-        old_stdout = sys.stdout
-        buff = StringIO()
-        sys.stdout = buff
-
-        raised_exception = None
-        try:
-            reporter_test = NagiosReporter('test_cache', filename, threshold, self.nagios_user)
-            reporter_test.report_and_exit()
-        except SystemExit as err:
-            raised_exception = err
-
-        line = buff.getvalue().rstrip()
-        # restore stdout
-        buff.close()
-        sys.stdout = old_stdout
-        self.assertEqual(raised_exception.code, NAGIOS_EXIT_UNKNOWN[0],
+
+        # report as if threshold + 1 seconds have passed
+        self.mock_stdout(True)
+        with self.assertRaises(SystemExit) as cm, \
+                mock.patch('vsc.utils.nagios.time.time', return_value=time.time() + threshold + 1):
+            reporter.report_and_exit()
+        stdout = self.get_stdout().rstrip()
+        self.mock_stdout(False)
+
+        self.assertEqual(cm.exception.code, NAGIOS_EXIT_UNKNOWN[0],
                          "Too old caches lead to unknown status")
-        self.assertTrue(line.startswith(f"{NAGIOS_EXIT_UNKNOWN[1]} test_cache gzipped JSON file too old (timestamp ="))
+        self.assertTrue(stdout.startswith(
+            f"{NAGIOS_EXIT_UNKNOWN[1]} test_cache gzipped JSON file too old (timestamp ="))
 
         os.unlink(filename)
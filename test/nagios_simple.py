@@ -29,11 +29,8 @@ Tests for the NagiosResult class in the vsc.utils.nagios module
 @author: Stijn De Weirdt (Ghent University)
 """
 import os
-import tempfile
-import sys
 import stat
 from pwd import getpwuid
-from io import StringIO
 
 from vsc.install.testing import TestCase
 
@@ -41,112 +38,92 @@ from vsc.utils.nagios import SimpleNagios, NAGIOS_EXIT_OK, NAGIOS_EXIT_CRITICAL
 from vsc.utils.nagios import NAGIOS_EXIT_WARNING, NAGIOS_EXIT_UNKNOWN, NagiosReporter
 from vsc.utils.nagios import exit_from_errorcode
 
+NAGIOS_USER = getpwuid(os.getuid()).pw_name
+
+# (errorcode, expected exit code) pairs for exit_from_errorcode
+EXIT_CASES = [
+    (0, NAGIOS_EXIT_OK[0]),
+    (1, NAGIOS_EXIT_WARNING[0]),
+    (2, NAGIOS_EXIT_CRITICAL[0]),
+    (3, NAGIOS_EXIT_UNKNOWN[0]),
+    (101, NAGIOS_EXIT_UNKNOWN[0]),
+]
+
 
 class TestSimpleNagios(TestCase):
     """Test for the SimpleNagios class."""
 
     def setUp(self):
-        """redirect stdout"""
-        self.old_stdout = sys.stdout
-        self.buffo = StringIO()
-        sys.stdout = self.buffo
-        user = getpwuid(os.getuid())
-        self.nagios_user = user.pw_name
-
-    def tearDown(self):
-        """Restore stdout"""
-        self.buffo.close()
-        sys.stdout = self.old_stdout
+        """mock stdout"""
+        super().setUp()
+        self.mock_stdout(True)
+        self.nagios_user = NAGIOS_USER
+        self.cache_path = os.path.join(self.tmpdir, 'cache.gz')
 
     def _basic_test_single_instance(self, kwargs, message, nagios_exit):
         """Basic test"""
 
-        self.buffo.seek(0)
-        self.buffo.truncate(0)
+        self.mock_stdout(True)
 
-        raised_exception = None
-        try:
+        with self.assertRaises(SystemExit) as cm:
             SimpleNagios(**kwargs)
-        except SystemExit as err:
-            raised_exception = err
-
-        bo = self.buffo.getvalue().rstrip()
 
-        self.assertEqual(bo, message)
-        self.assertEqual(raised_exception.code, nagios_exit[0])
+        self.assertEqual(self.get_stdout().rstrip(), message)
+        self.assertEqual(cm.exception.code, nagios_exit[0])
 
     def _basic_test_single_instance_and_exit(self, fn, msg, message, nagios_exit):
         """Basic test"""
 
-        self.buffo.seek(0)
-        self.buffo.truncate(0)
+        self.mock_stdout(True)
 
         nagios = SimpleNagios()
         func = getattr(nagios, fn)
 
-        raised_exception = None
-        try:
+        with self.assertRaises(SystemExit) as cm:
             func(msg)
-        except SystemExit as err:
-            raised_exception = err
 
-        bo = self.buffo.getvalue().rstrip()
-
-        self.assertEqual(bo, message)
-        self.assertEqual(raised_exception.code, nagios_exit[0])
+        self.assertEqual(self.get_stdout().rstrip(), message)
+        self.assertEqual(cm.exception.code, nagios_exit[0])
 
     def test_simple_single_instance(self):
         """Test what is generated when performance data is given, but not critical/warning"""
-        kwargs = {
-            'message': 'hello',
-            'value1': 3,
-            'value1_warning': 5,
-            'value1_critical': 10,
-        }
-        self._basic_test_single_instance(kwargs, 'OK hello | value1=3;5;10;', NAGIOS_EXIT_OK)
-        # outside warning range
-        kwargs['value1'] = 5
-        self._basic_test_single_instance(kwargs, 'OK hello | value1=5;5;10;', NAGIOS_EXIT_OK)
-        # goutside warning range, perfdata with warning in message
-        kwargs['value1'] = 7
-        self._basic_test_single_instance(kwargs, 'WARNING value1, hello | value1=7;5;10;', NAGIOS_EXIT_WARNING)
-        # outside critical range?
-        kwargs['value1'] = 10
-        self._basic_test_single_instance(kwargs, 'WARNING value1, hello | value1=10;5;10;', NAGIOS_EXIT_WARNING)
-        # greater
-        kwargs['value1'] = 15
-        self._basic_test_single_instance(kwargs, 'CRITICAL value1, hello | value1=15;5;10;', NAGIOS_EXIT_CRITICAL)
-
-        # mixed
-        kwargsmore = {
+        value1 = {'value1_warning': 5, 'value1_critical': 10}
+        mixed = {
             'value0': 3,
             'value0_warning': 5,
             'value0_critical': 10,
-            'value2': 7,
             'value2_warning': 5,
             'value2_critical': 10,
         }
-        kwargs.update(kwargsmore)
-
-        # critical value in message
-        self._basic_test_single_instance(kwargs, 'CRITICAL value1, hello | value0=3;5;10; value1=15;5;10; value2=7;5;10;',
-                                         NAGIOS_EXIT_CRITICAL)
-
-        # all warning values in message
-        kwargs['value1'] = 7
-        self._basic_test_single_instance(
-            kwargs, 'WARNING value1, value2, hello | value0=3;5;10; value1=7;5;10; value2=7;5;10;', NAGIOS_EXIT_WARNING)
-
-        # warning in message
-        kwargs['value1'] = 5
-        self._basic_test_single_instance(kwargs, 'WARNING value2, hello | value0=3;5;10; value1=5;5;10; value2=7;5;10;',
-                                         NAGIOS_EXIT_WARNING)
-
-        # no warning/critical; so regular message
-        kwargs['value2'] = 5
-        self._basic_test_single_instance(kwargs, 'OK hello | value0=3;5;10; value1=5;5;10; value2=5;5;10;',
-                                         NAGIOS_EXIT_OK)
-
+        cases = [
+            # below warning range
+            ({'value1': 3}, 'OK hello | value1=3;5;10;', NAGIOS_EXIT_OK),
+            # at warning boundary
+            ({'value1': 5}, 'OK hello | value1=5;5;10;', NAGIOS_EXIT_OK),
+            # outside warning range, perfdata with warning in message
+            ({'value1': 7}, 'WARNING value1, hello | value1=7;5;10;', NAGIOS_EXIT_WARNING),
+            # at critical boundary
+            ({'value1': 10}, 'WARNING value1, hello | value1=10;5;10;', NAGIOS_EXIT_WARNING),
+            # greater
+            ({'value1': 15}, 'CRITICAL value1, hello | value1=15;5;10;', NAGIOS_EXIT_CRITICAL),
+            # mixed: critical value in message
+            (dict(mixed, value1=15, value2=7),
+             'CRITICAL value1, hello | value0=3;5;10; value1=15;5;10; value2=7;5;10;', NAGIOS_EXIT_CRITICAL),
+            # mixed: all warning values in message
+            (dict(mixed, value1=7, value2=7),
+             'WARNING value1, value2, hello | value0=3;5;10; value1=7;5;10; value2=7;5;10;', NAGIOS_EXIT_WARNING),
+            # mixed: warning in message
+            (dict(mixed, value1=5, value2=7),
+             'WARNING value2, hello | value0=3;5;10; value1=5;5;10; value2=7;5;10;', NAGIOS_EXIT_WARNING),
+            # mixed: no warning/critical; so regular message
+            (dict(mixed, value1=5, value2=5),
+             'OK hello | value0=3;5;10; value1=5;5;10; value2=5;5;10;', NAGIOS_EXIT_OK),
+        ]
+
+        for values, message, nagios_exit in cases:
+            kwargs = dict(value1, message='hello', **values)
+            with self.subTest(values=values):
+                self._basic_test_single_instance(kwargs, message, nagios_exit)
 
     def test_simple_nagios_instance_and_nagios_exit(self):
         """Test the basic ok/warning/critical/unknown"""
@@ -157,27 +134,20 @@ class TestSimpleNagios(TestCase):
 
     def test_cache(self):
         """Test the caching"""
-        (handle, filename) = tempfile.mkstemp()
-        os.unlink(filename)
+        filename = self.cache_path
 
         n = SimpleNagios(_cache=filename, _cache_user=self.nagios_user)
         message = "mywarning"
         n.warning(message)
-        os.close(handle)
 
-        self.buffo.seek(0)
-        self.buffo.truncate(0)
+        self.mock_stdout(True)
 
-        raised_exception = None
-        try:
+        with self.assertRaises(SystemExit) as cm:
             reporter_test = NagiosReporter('test_cache', filename, -1, self.nagios_user)
             reporter_test.report_and_exit()
-        except SystemExit as err:
-            raised_exception = err
-        bo = self.buffo.getvalue().rstrip()
 
-        self.assertEqual(bo, f"WARNING {message}")
-        self.assertEqual(raised_exception.code, NAGIOS_EXIT_WARNING[0])
+        self.assertEqual(self.get_stdout().rstrip(), f"WARNING {message}")
+        self.assertEqual(cm.exception.code, NAGIOS_EXIT_WARNING[0])
 
         statres = os.stat(filename)
 
@@ -185,18 +155,14 @@ class TestSimpleNagios(TestCase):
 
     def test_world_readable(self):
         """Test world readable cache"""
-        (handle, filename) = tempfile.mkstemp()
-        os.unlink(filename)
+        filename = self.cache_path
 
         n = SimpleNagios(_cache=filename, _cache_user=self.nagios_user, _world_readable=True)
         n.ok("test")
-        os.close(handle)
 
-        try:
+        with self.assertRaises(SystemExit):
             reporter_test = NagiosReporter('test_cache', filename, -1, self.nagios_user)
             reporter_test.report_and_exit()
-        except SystemExit:
-            pass
 
         statres = os.stat(filename)
 
@@ -207,30 +173,15 @@ class TestNagiosExits(TestCase):
     """Test for all things exiting with nagios results."""
 
     def setUp(self):
-        """redirect stdout"""
-        self.old_stdout = sys.stdout
-        self.buffo = StringIO()
-        sys.stdout = self.buffo
-        user = getpwuid(os.getuid())
-        self.nagios_user = user.pw_name
-
-    def tearDown(self):
-        """Restore stdout"""
-        self.buffo.close()
-        sys.stdout = self.old_stdout
+        """mock stdout"""
+        super().setUp()
+        self.mock_stdout(True)
+        self.nagios_user = NAGIOS_USER
 
     def test_exit_from_errorcode(self):
         """test calling the correct exit function."""
 
-        for (ec, expected) in [
-                (0, NAGIOS_EXIT_OK),
-                (1, NAGIOS_EXIT_WARNING),
-                (2, NAGIOS_EXIT_CRITICAL),
-                (3, NAGIOS_EXIT_UNKNOWN),
-                (101, NAGIOS_EXIT_UNKNOWN),
-                ]:
-            try:
+        for (ec, expected) in EXIT_CASES:
+            with self.assertRaises(SystemExit) as cm:
                 exit_from_errorcode(ec, "boem")
-            except SystemExit as err:
-                print(err)
-                self.assertTrue(err.code == expected[0])
+            self.assertEqual(cm.exception.code, expected)
@@ -30,68 +30,80 @@ Tests for the classes and functions in vsc.utils.scrip_tools
 """
 
 import logging
+import os
 import random
 import sys
 import tempfile
 import getpass
+from types import SimpleNamespace
+
 import mock
 
 from vsc.install.testing import TestCase
+from vsc.utils import nagios, script_tools
 from vsc.utils.nagios import NAGIOS_EXIT_WARNING
 from vsc.utils.script_tools import ExtendedSimpleOption, DEFAULT_OPTIONS, NrpeCLI, CLI
 
+ARGV0 = sys.argv[0]
+CURRENT_USER = getpass.getuser()
+# fixed seed, so failures can be reproduced
+RNG = random.Random(1234567)
+
+# ExtendedSimpleOption defaults shared by the CLI option tests
+EXTSIMPOPTS = {
+    'configfiles': None,
+    'debug': False,
+    'disable_locking': False,
+    'dry_run': False,
+    'ha': None,
+    'help': None,
+    'ignoreconfigfiles': None,
+    'info': False,
+    'locking_filename': '/var/lock/setup.lock',
+    'nagios_check_filename': '/var/cache/setup.nagios.json.gz',
+    'nagios_check_interval_threshold': 0,
+    'nagios_report': False,
+    'nagios_user': 'nrpe',
+    'nagios_world_readable_check': False,
+    'quiet': False,
+}
+
 class TestExtendedSimpleOption(TestCase):
     """
     Tests for the ExtendedSimpleOption class.
     """
+    DEFAULT_THRESHOLD = DEFAULT_OPTIONS['nagios-check-interval-threshold'][3]
+
     def setUp(self):
-        """Backup sys.argv"""
-        super(TestCase, self).setUp()
-        # make a copy of sys.argv
-        self._old_argv = sys.argv[:]
-        sys.argv = sys.argv[:1]
-
-    def tearDown(self):
-        """restore sys.argv"""
-        super(TestCase, self).tearDown()
-        sys.argv = self._old_argv
-
-    @mock.patch('vsc.utils.script_tools.TimestampedPidLockfile')
-    @mock.patch('vsc.utils.script_tools.lock_or_bork')
-    @mock.patch('vsc.utils.script_tools.proceed_on_ha_service')
-    def test_threshold_default_setting(self, mock_proceed, _, mock_lockfile):
-        """Test if the default value is set"""
-        mock_proceed.return_value = True
-        mock_lockfile.return_value = mock.MagicMock()
-
-        opts = ExtendedSimpleOption(options={})
-        self.assertEqual(opts.options.nagios_check_interval_threshold,
-                         DEFAULT_OPTIONS['nagios-check-interval-threshold'][3])
-        self.assertEqual(opts.nagios_reporter._threshold,
-                         DEFAULT_OPTIONS['nagios-check-interval-threshold'][3])
-        self.assertEqual(opts.nagios_reporter._cache_user, 'nrpe')
-        self.assertEqual(opts.options.nagios_user, 'nrpe')
-        self.assertFalse(opts.nagios_reporter._world_readable)
-        self.assertFalse(opts.options.nagios_world_readable_check)
-
-    @mock.patch('vsc.utils.script_tools.TimestampedPidLockfile')
-    @mock.patch('vsc.utils.script_tools.lock_or_bork')
-    @mock.patch('vsc.utils.script_tools.proceed_on_ha_service')
-    def test_threshold_custom_setting(self, mock_proceed, _, mock_lockfile):
-        """Test if a custom value is passed on correctly"""
-        mock_proceed.return_value = True
-        mock_lockfile.return_value = mock.MagicMock()
-
-        threshold = random.uniform(1, 1000)
-
-        opts = ExtendedSimpleOption({'nagios-check-interval-threshold': threshold,
-                                     'nagios-user': 'nrpe',
-                                     'nagios-world-readable-check': True})
-        self.assertEqual(opts.options.nagios_check_interval_threshold, threshold)
-        self.assertEqual(opts.options.nagios_user, 'nrpe')
-        self.assertEqual(opts.nagios_reporter._cache_user, 'nrpe')
-        self.assertTrue(opts.nagios_reporter._world_readable)
-        self.assertTrue(opts.options.nagios_world_readable_check)
+        """Only pass the script name and mock out the locking and HA checks"""
+        super().setUp()
+        self.create_patch('sys.argv', [ARGV0])
+        self.create_patch('vsc.utils.script_tools.lock_or_bork')
+        self.mock_proceed = self.create_patch('vsc.utils.script_tools.proceed_on_ha_service', return_value=True)
+        self.mock_lockfile = self.create_patch('vsc.utils.script_tools.TimestampedPidLockfile')
+        # lock_or_bork is mocked as well, the lockfile is only handed to it (and release_or_bork in the epilogue)
+        self.mock_lockfile.return_value = SimpleNamespace(acquire=lambda: None, release=lambda: None)
+
+    def test_threshold_setting(self):
+        """Test if the default value is set and a custom value is passed on correctly"""
+        threshold = RNG.uniform(1, 1000)
+
+        cases = [
+            # options, expected threshold, expected world readable
+            ({}, self.DEFAULT_THRESHOLD, False),
+            ({'nagios-check-interval-threshold': threshold,
+              'nagios-user': 'nrpe',
+              'nagios-world-readable-check': True}, threshold, True),
+        ]
+        for options, expected_threshold, world_readable in cases:
+            with self.subTest(options=options):
+                opts = ExtendedSimpleOption(options=options)
+                self.assertEqual(opts.options.nagios_check_interval_threshold, expected_threshold)
+                self.assertEqual(opts.nagios_reporter._threshold, expected_threshold)
+                self.assertEqual(opts.nagios_reporter._cache_user, 'nrpe')
+                self.assertEqual(opts.options.nagios_user, 'nrpe')
+                self.assertEqual(opts.nagios_reporter._world_readable, world_readable)
+                self.assertEqual(opts.options.nagios_world_readable_check, world_readable)
 
 
 magic = mock.MagicMock(name='magic')
@@ -105,128 +117,95 @@ class MyNrpeCLI(NrpeCLI):
         return magic.go()
 
 
+def my_cli_options(directory):
+    """Return the CLI_OPTIONS of MyCLI, with the nagios check and locking files in directory"""
+    return {
+        'magic': ('some magic', None, 'store', 'magicdef'),
+        'nagios_check_filename': ('bla', None, 'store', os.path.join(directory, 'nagios.json.gz')),
+        'locking_filename': ('test', None, 'store', os.path.join(directory, 'setup.lock')),
+        'nagios_user': ('user nagios runs as', 'string', 'store', CURRENT_USER),
+    }
+
+
 class MyCLI(CLI):
     TIMESTAMP_MANDATORY = False  # mainly for testing, you really should need this in production
-    TESTFILE = tempfile.mkstemp()[1]
-    TESTFILE2 = tempfile.mkstemp()[1]
+    # these files are not created, TestCLI points them to its own test directory
+    CLI_OPTIONS = my_cli_options(tempfile.gettempdir())
 
-    CLI_OPTIONS = {
-        'magic': ('some magic', None, 'store', 'magicdef'),
-        'nagios_check_filename': ('bla', None, 'store', TESTFILE),
-        'locking_filename': ('test', None, 'store', TESTFILE2),
-        'nagios_user': ('user nagios runs as', 'string', 'store', getpass.getuser()),
-    }
     def do(self, _):
         return magic.go()
 
-class TestNrpeCLI(TestCase):
-    """Tests for the CLI base class"""
+class CLITestCase(TestCase):
+    """Shared checks for the CLI tests"""
 
-    @mock.patch('vsc.utils.script_tools.ExtendedSimpleOption.prologue')
-    def test_opts(self, _):
+    def _assert_cli_opts(self, cli_class, extsimpopts):
+        """Check the options of cli_class, with and without the default sync options"""
         sys.argv = ['abc']
-        ms = MyNrpeCLI()
-
-        logging.debug("options %s %s %s", ms.options, dir(ms.options), vars(ms.options))
-
-        extsimpopts = {
-            'configfiles': None,
-            'debug': False,
-            'disable_locking': False,
-            'dry_run': False,
-            'ha': None,
-            'help': None,
-            'ignoreconfigfiles': None,
-            'info': False,
-            'locking_filename': '/var/lock/setup.lock',
-            'nagios_check_filename': '/var/cache/setup.nagios.json.gz',
-            'nagios_check_interval_threshold': 0,
-            'nagios_report': False,
-            'nagios_user': 'nrpe',
-            'nagios_world_readable_check': False,
-            'quiet': False,
-        }
+        ms = cli_class()
+
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            # dir() and vars() are evaluated before logging.debug gets to filter
+            logging.debug("options %s %s %s", ms.options, dir(ms.options), vars(ms.options))
 
         myopts = {
+            **extsimpopts,
             'magic': 'magicdef',
             'start_timestamp': None,
             'timestamp_file': '/var/cache/abc.timestamp',
         }
-        myopts.update(extsimpopts)
         self.assertEqual(ms.options.__dict__, myopts)
 
         myopts = {
+            **extsimpopts,
             'magic': 'magicdef',
         }
-        myopts.update(extsimpopts)
-        ms = MyNrpeCLI(default_options={})
+        ms = cli_class(default_options={})
         logging.debug("options wo default sync options %s", ms.options)
         self.assertEqual(ms.options.__dict__, myopts)
 
-    @mock.patch('vsc.utils.script_tools.ExtendedSimpleOption.prologue')
+
+class TestNrpeCLI(CLITestCase):
+    """Tests for the CLI base class"""
+
+    @mock.patch.object(ExtendedSimpleOption, 'prologue')
+    def test_opts(self, _):
+        self._assert_cli_opts(MyNrpeCLI, EXTSIMPOPTS)
+
+    @mock.patch.object(ExtendedSimpleOption, 'prologue')
     def test_exit(self, _):
 
         cli = MyNrpeCLI()
 
         fake_exit = mock.MagicMock()
-        with mock.patch('vsc.utils.nagios._real_exit', fake_exit):
+        with mock.patch.object(nagios, '_real_exit', fake_exit):
             cli.warning("be warned")
             fake_exit.assert_called_with("be warned", NAGIOS_EXIT_WARNING)
 
 
-class TestCLI(TestCase):
+class TestCLI(CLITestCase):
     """Tests for the CLI base class"""
 
-    @mock.patch('vsc.utils.script_tools.ExtendedSimpleOption.prologue')
-    def test_opts(self, _):
-        sys.argv = ['abc']
-        ms = MyCLI()
-
-        logging.debug("options %s %s %s", ms.options, dir(ms.options), vars(ms.options))
-
-
-
-        extsimpopts = {
-            'configfiles': None,
-            'debug': False,
-            'disable_locking': False,
-            'dry_run': False,
-            'ha': None,
-            'help': None,
-            'ignoreconfigfiles': None,
-            'info': False,
-            'locking_filename': ms.TESTFILE2,
-            'nagios_check_filename': ms.TESTFILE,
-            'nagios_check_interval_threshold': 0,
-            'nagios_report': False,
-            'nagios_user': getpass.getuser(),
-            'nagios_world_readable_check': False,
-            'quiet': False,
-        }
-
-        myopts = {
-            'magic': 'magicdef',
-            'start_timestamp': None,
-            'timestamp_file': '/var/cache/abc.timestamp',
-        }
-        myopts.update(extsimpopts)
-        self.assertEqual(ms.options.__dict__, myopts)
-
-        myopts = {
-            'magic': 'magicdef',
-        }
-        myopts.update(extsimpopts)
-        ms = MyCLI(default_options={})
-        logging.debug("options wo default sync options %s", ms.options)
-        self.assertEqual(ms.options.__dict__, myopts)
+    def setUp(self):
+        """Put the nagios check and locking files of MyCLI in the test directory"""
+        super().setUp()
+        self.create_patch(f"{__name__}.MyCLI.CLI_OPTIONS", my_cli_options(self.tmpdir))
 
-    @mock.patch('vsc.utils.script_tools.lock_or_bork')
-    @mock.patch('vsc.utils.script_tools.release_or_bork')
+    @mock.patch.object(ExtendedSimpleOption, 'prologue')
+    def test_opts(self, _):
+        self._assert_cli_opts(MyCLI, {
+            **EXTSIMPOPTS,
+            'locking_filename': os.path.join(self.tmpdir, 'setup.lock'),
+            'nagios_check_filename': os.path.join(self.tmpdir, 'nagios.json.gz'),
+            'nagios_user': CURRENT_USER,
+        })
+
+    @mock.patch.object(script_tools, 'lock_or_bork')
+    @mock.patch.object(script_tools, 'release_or_bork')
     def test_exit(self, locklock, releaselock):
 
         cli = MyCLI()
 
         fake_exit = mock.MagicMock()
-        with mock.patch('sys.exit', fake_exit):
+        with mock.patch.object(sys, 'exit', fake_exit):
             cli.warning("be warned")
             fake_exit.assert_called_with(1)
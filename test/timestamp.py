@@ -28,16 +28,17 @@ Unit tests for vsc.utils.timestamp
 
 @author: Jens Timmerman (Ghent University)
 """
+import time
 import mock
 
 from datetime import datetime
 
 from vsc.install.testing import TestCase
 from vsc.utils.dateandtime import utc
-from vsc.utils.run import run
 
 from vsc.utils.timestamp import convert_to_datetime, convert_to_unix_timestamp, convert_timestamp
-from vsc.utils.timestamp import retrieve_timestamp_with_default, DEFAULT_TIMESTAMP
+from vsc.utils.timestamp import retrieve_timestamp_with_default, retrieve_timestamps_with_default, DEFAULT_TIMESTAMP
+from vsc.utils.timestamp import _convert_string_to_datetime
 
 
 class TestTimestamp(TestCase):
@@ -45,37 +46,40 @@ class TestTimestamp(TestCase):
 
     #TODO: test with 201710290205  ( ambigious )
     def test_convert_to_datetime(self):
-        date = datetime(1970, 1, 1, tzinfo=utc)
-        self.assertEqual(convert_to_datetime("19700101"), date)
-        self.assertEqual(convert_to_datetime("0000000000"), date)
-        self.assertEqual(convert_to_datetime(0), date)
-        self.assertEqual(convert_to_datetime("197001010000"), date)
-        self.assertEqual(convert_to_datetime("19700101000000Z"), date)
-        self.assertEqual(convert_to_datetime(date), date)
-
-        date = datetime(2018, 3, 25,0,0, tzinfo=utc)
-        self.assertEqual(convert_to_datetime("20180325"), date)
-        date = datetime(2018, 3, 25,1,5, tzinfo=utc)
-        self.assertEqual(convert_to_datetime("1521939900"), date)
-        self.assertEqual(convert_to_datetime(1521939900), date)
-        self.assertEqual(convert_to_datetime("201803250105"), date)
-        self.assertEqual(convert_to_datetime("20180325010500Z"), date)
-        self.assertEqual(convert_to_datetime(date), date)
-
-        date = datetime(2017, 10, 29, 0,0, tzinfo=utc)
-        self.assertEqual(convert_to_datetime("20171029"), date)
-        date = datetime(2017, 10, 29,1,5, tzinfo=utc)
-        self.assertEqual(convert_to_datetime("1509239100"), date)
-        self.assertEqual(convert_to_datetime(1509239100), date)
-        self.assertEqual(convert_to_datetime("201710290105"), date)
-        self.assertEqual(convert_to_datetime("20171029010500Z"), date)
-        self.assertEqual(convert_to_datetime(date), date)
-
+        date_1970 = datetime(1970, 1, 1, tzinfo=utc)
+        date_2018 = datetime(2018, 3, 25, 1, 5, tzinfo=utc)
+        date_2017 = datetime(2017, 10, 29, 1, 5, tzinfo=utc)
+        cases = [
+            (date_1970, ["19700101", "0000000000", 0, "197001010000", "19700101000000Z", date_1970]),
+            (datetime(2018, 3, 25, 0, 0, tzinfo=utc), ["20180325"]),
+            (date_2018, ["1521939900", 1521939900, "201803250105", "20180325010500Z", date_2018]),
+            (datetime(2017, 10, 29, 0, 0, tzinfo=utc), ["20171029"]),
+            (date_2017, ["1509239100", 1509239100, "201710290105", "20171029010500Z", date_2017]),
+        ]
+        for expected, timestamps in cases:
+            for timestamp in timestamps:
+                with self.subTest(timestamp=timestamp):
+                    self.assertEqual(convert_to_datetime(timestamp), expected)
+
+    def test_convert_to_datetime_cached(self):
+        """Repeated conversions of the same string are only parsed once"""
+        _convert_string_to_datetime.cache_clear()
+        date = datetime(2018, 3, 25, 1, 5, tzinfo=utc)
+        for _ in range(1000):
+            self.assertEqual(convert_to_datetime("20180325010500Z"), date)
+
+        info = _convert_string_to_datetime.cache_info()
+        self.assertEqual(info.misses, 1)
+        self.assertEqual(info.hits, 999)
+
+        self.assertErrorRegex(ValueError, "invalid format provided", convert_to_datetime, "2018")
+        self.assertErrorRegex(ValueError, "invalid format provided", convert_to_datetime, "20180325010500X")
+        self.assertErrorRegex(ValueError, "month must be in 1..12", convert_to_datetime, "20181325")
 
     def test_convert_to_unix_timestamp(self):
-        _, out = run(['date', '+%s'])
+        expected = int(time.time())
         nowts = convert_to_unix_timestamp()
-        self.assertTrue(abs(nowts - int(out.strip())) < 2)
+        self.assertLess(abs(nowts - expected), 2)
 
         date = 0
         self.assertEqual(convert_to_unix_timestamp("19700101"), date)
@@ -152,3 +156,27 @@ class TestTimestamp(TestCase):
 
         mock_read_timestamp.return_value = None
         self.assertEqual(convert_to_unix_timestamp(default_ts), retrieve_timestamp_with_default("f", default_timestamp=default_ts)[0])
+
+    @mock.patch('vsc.utils.timestamp.read_timestamp')
+    def test_retrieve_timestamps(self, mock_read_timestamp):
+        """Test for the batched filestamp retrieval."""
+        stored = {"f1": "203412130101", "f2": None, "f3": 1521939900}
+        mock_read_timestamp.side_effect = stored.get
+
+        default_ts = "20150103"
+        (timestamps, current_time) = retrieve_timestamps_with_default(["f1", "f2", "f3"], default_timestamp=default_ts)
+        self.assertEqual(timestamps, {
+            "f1": convert_to_unix_timestamp("203412130101"),
+            "f2": convert_to_unix_timestamp(default_ts),
+            "f3": 1521939900,
+        })
+        self.assertEqual(utc, current_time.tzinfo)
+
+        # start_timestamp takes precedence, no files are read
+        mock_read_timestamp.reset_mock()
+        start_ts = "20140102"
+        (timestamps, _) = retrieve_timestamps_with_default(["f1", "f2"], start_timestamp=start_ts)
+        self.assertEqual(timestamps, dict.fromkeys(["f1", "f2"], convert_to_unix_timestamp(start_ts)))
+        mock_read_timestamp.assert_not_called()
+
+        self.assertEqual(retrieve_timestamps_with_default([])[0], {})
@@ -0,0 +1,271 @@
+#
+# Copyright 2025-2025 Ghent University
+#
+# This file is part of vsc-utils,
+# originally created by the HPC team of Ghent University (http://ugent.be/hpc/en),
+# with support of Ghent University (http://ugent.be/hpc),
+# the Flemish Supercomputer Centre (VSC) (https://www.vscentrum.be),
+# the Flemish Research Foundation (FWO) (http://www.fwo.be/en)
+# and the Department of Economy, Science and Innovation (EWI) (http://www.ewi-vlaanderen.be/en).
+#
+# https://github.com/hpcugent/vsc-utils
+#
+# vsc-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as
+# published by the Free Software Foundation, either version 2 of
+# the License, or (at your option) any later version.
+#
+# vsc-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with vsc-utils. If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Unit tests for vsc.utils.timestamp_pid_lockfile
+"""
+import builtins
+import errno
+import os
+import signal
+import subprocess
+import threading
+import time
+
+import mock
+from lockfile.linklockfile import LockFailed
+
+from vsc.install.testing import TestCase
+from vsc.utils import timestamp_pid_lockfile
+from vsc.utils.timestamp_pid_lockfile import TimestampedPidLockfile, LockFileReadError
+from vsc.utils.timestamp_pid_lockfile import _read_pid_timestamp_file, _read_lockfile, _proc_starttime, _pid_alive
+from vsc.utils.timestamp_pid_lockfile import _find_and_kill
+
+
+class TestTimestampedPidLockfile(TestCase):
+    """Tests for the TimestampedPidLockfile class."""
+
+    def setUp(self):
+        """Put the lockfile in the test directory"""
+        super().setUp()
+        self.path = os.path.join(self.tmpdir, 'test.lock')
+
+    def test_acquire_release(self):
+        """Test taking and releasing the lock."""
+        lock = TimestampedPidLockfile(self.path, threshold=60)
+        self.assertFalse(lock.is_locked())
+        self.assertFalse(lock.i_am_locking())
+
+        lock.acquire()
+        self.assertTrue(lock.is_locked())
+        self.assertTrue(lock.i_am_locking())
+        (pid, _, starttime) = _read_lockfile(self.path)
+        self.assertEqual(pid, os.getpid())
+        self.assertEqual(starttime, _proc_starttime(os.getpid()))
+
+        lock.release()
+        self.assertFalse(lock.is_locked())
+
+    def test_read_pid_timestamp_file(self):
+        """Test parsing the lockfile contents."""
+        self.assertEqual(_read_pid_timestamp_file(self.path), None)
+
+        with open(self.path, 'w', encoding='utf8') as lockfp:
+            lockfp.write("123\n456\n")
+        self.assertEqual(_read_pid_timestamp_file(self.path), (123, 456))
+        self.assertEqual(_read_lockfile(self.path), (123, 456, None))
+
+        with open(self.path, 'w', encoding='utf8') as lockfp:
+            lockfp.write("123\n456\n789\n")
+        self.assertEqual(_read_pid_timestamp_file(self.path), (123, 456))
+        self.assertEqual(_read_lockfile(self.path), (123, 456, 789))
+
+        with open(self.path, 'w', encoding='utf8') as lockfp:
+            lockfp.write("123\n")
+        self.assertRaises(LockFileReadError, _read_pid_timestamp_file, self.path)
+
+    def test_acquire_locked(self):
+        """Test that a recent lock held by someone else cannot be taken."""
+        with open(self.path, 'w', encoding='utf8') as lockfp:
+            lockfp.write(f"1\n{int(time.time())}\n")
+
+        lock = TimestampedPidLockfile(self.path, threshold=60, retry_timeout=0)
+        self.assertTrue(lock.is_locked())
+        self.assertFalse(lock.i_am_locking())
+        self.assertRaises(LockFailed, lock.acquire)
+
+        lock = TimestampedPidLockfile(self.path, threshold=60, retry_timeout=0.1)
+        start = time.monotonic()
+        self.assertRaises(LockFailed, lock.acquire)
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_acquire_error(self):
+        """Test that errors other than a held lock are not retried."""
+        lock = TimestampedPidLockfile(os.path.join(self.tmpdir, 'missing', 'test.lock'), threshold=60, retry_timeout=5)
+        start = time.monotonic()
+        self.assertRaises(LockFailed, lock.acquire)
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_acquire_unreadable(self):
+        """Test that a lockfile that cannot be read raises a LockFileReadError."""
+        os.mkdir(self.path)
+        lock = TimestampedPidLockfile(self.path, threshold=60, retry_timeout=0)
+        self.assertRaises(LockFileReadError, lock.acquire)
+
+        os.rmdir(self.path)
+        with open(self.path, 'w', encoding='utf8') as lockfp:
+            lockfp.write(f"1\n{int(time.time())}\n")
+        with mock.patch.object(builtins, 'open', side_effect=PermissionError(errno.EACCES, 'Permission denied')):
+            self.assertRaises(LockFileReadError, lock.acquire)
+
+    def test_acquire_retry(self):
+        """Test that a lock released by its holder shortly after is obtained on retry."""
+        with open(self.path, 'w', encoding='utf8') as lockfp:
+            lockfp.write(f"1\n{int(time.time())}\n")
+
+        release = threading.Timer(0.05, os.unlink, args=(self.path,))
+        release.start()
+        lock = TimestampedPidLockfile(self.path, threshold=60, retry_timeout=5)
+        lock.acquire()
+        release.join()
+        self.assertTrue(lock.i_am_locking())
+        lock.release()
+
+    def test_acquire_stale(self):
+        """Test that a lockfile older than the threshold is taken over."""
+        with open(self.path, 'w', encoding='utf8') as lockfp:
+            lockfp.write(f"{2**22 + 1}\n{int(time.time()) - 120}\n")
+        os.utime(self.path, (time.time() - 120, time.time() - 120))
+
+        lock = TimestampedPidLockfile(self.path, threshold=60)
+        lock.acquire()
+        self.assertTrue(lock.i_am_locking())
+        lock.release()
+
+    @mock.patch.object(timestamp_pid_lockfile, '_find_and_kill')
+    def test_acquire_stale_reused_pid(self, mock_find_and_kill):
+        """Test that the process reusing the PID of an obsolete lockfile is not killed."""
+        starttime = _proc_starttime(os.getpid())
+        with open(self.path, 'w', encoding='utf8') as lockfp:
+            lockfp.write(f"{os.getpid()}\n{int(time.time()) - 120}\n{starttime - 1}\n")
+        os.utime(self.path, (time.time() - 120, time.time() - 120))
+
+        lock = TimestampedPidLockfile(self.path, threshold=60, kill_obsolete=True)
+        lock.acquire()
+        mock_find_and_kill.assert_not_called()
+        lock.release()
+
+    @mock.patch.object(timestamp_pid_lockfile, '_find_and_kill')
+    def test_acquire_stale_invalid(self, mock_find_and_kill):
+        """Test that an obsolete lockfile without valid contents is taken over without killing anyone."""
+        for contents in ["", "123\n"]:
+            with open(self.path, 'w', encoding='utf8') as lockfp:
+                lockfp.write(contents)
+            os.utime(self.path, (time.time() - 120, time.time() - 120))
+
+            lock = TimestampedPidLockfile(self.path, threshold=60, kill_obsolete=True)
+            lock.acquire()
+            self.assertTrue(lock.i_am_locking())
+            lock.release()
+        mock_find_and_kill.assert_not_called()
+
+    @mock.patch.object(timestamp_pid_lockfile, '_find_and_kill')
+    def test_acquire_stale_replaced(self, mock_find_and_kill):
+        """Test that a lock taken by someone else after the staleness check is left alone."""
+        with open(self.path, 'w', encoding='utf8') as lockfp:
+            lockfp.write(f"{os.getpid()}\n{int(time.time()) - 120}\n")
+        os.utime(self.path, (time.time() - 120, time.time() - 120))
+
+        stat_and_read_lockfile = timestamp_pid_lockfile._stat_and_read_lockfile
+
+        def replace_lock(path):
+            """Return the obsolete lock, but let a competing process break it and take it right after"""
+            lockstate = stat_and_read_lockfile(path)
+            os.unlink(path)
+            with open(path, 'w', encoding='utf8') as lockfp:
+                lockfp.write(f"1\n{int(time.time())}\n")
+            return lockstate
+
+        lock = TimestampedPidLockfile(self.path, threshold=60, retry_timeout=0, kill_obsolete=True)
+        with mock.patch.object(timestamp_pid_lockfile, '_stat_and_read_lockfile', side_effect=replace_lock):
+            self.assertRaises(LockFailed, lock.acquire)
+        mock_find_and_kill.assert_not_called()
+        self.assertEqual(_read_pid_timestamp_file(self.path)[0], 1)
+
+    def test_acquire_stale_holder_alive(self):
+        """Test that the live holder of an obsolete lock is only signalled when asked for."""
+        with subprocess.Popen(['sleep', '60']) as proc:
+            self.addCleanup(proc.kill)
+            with open(self.path, 'w', encoding='utf8') as lockfp:
+                lockfp.write(f"{proc.pid}\n{int(time.time())}\n{_proc_starttime(proc.pid)}\n")
+            os.utime(self.path, (time.time() - 1, time.time() - 1))
+
+            # threshold 0 (the script_tools default) makes every existing lock obsolete
+            lock = TimestampedPidLockfile(self.path, threshold=0)
+            lock.acquire()
+            self.assertTrue(lock.i_am_locking())
+            self.assertIsNone(proc.poll())
+            lock.release()
+
+            with open(self.path, 'w', encoding='utf8') as lockfp:
+                lockfp.write(f"{proc.pid}\n{int(time.time())}\n{_proc_starttime(proc.pid)}\n")
+            os.utime(self.path, (time.time() - 1, time.time() - 1))
+
+            lock = TimestampedPidLockfile(self.path, threshold=0, kill_obsolete=True)
+            lock.acquire()
+            self.assertEqual(proc.wait(), -signal.SIGHUP)
+            lock.release()
+
+    def test_pid_alive(self):
+        """Test checking if a process is still running."""
+        starttime = _proc_starttime(os.getpid())
+        self.assertTrue(_pid_alive(os.getpid()))
+        self.assertTrue(_pid_alive(os.getpid(), starttime))
+        self.assertFalse(_pid_alive(os.getpid(), starttime + 1))
+        self.assertFalse(_pid_alive(2**22 + 1))
+
+    def test_find_and_kill(self):
+        """Test killing the process holding an obsolete lock."""
+        self.assertFalse(_find_and_kill(2**22 + 1))
+
+        with subprocess.Popen(['sleep', '60']) as proc:
+            # make sure the child does not outlive a failing assertion
+            self.addCleanup(proc.kill)
+            self.assertTrue(_find_and_kill(proc.pid))
+            self.assertEqual(proc.wait(), -signal.SIGHUP)
+
+    def test_fork(self):
+        """Test that a forked child locks with its own PID."""
+        pid = os.fork()
+        if pid == 0:
+            exitcode = 1
+            try:
+                TimestampedPidLockfile(self.path, threshold=60).acquire()
+                exitcode = 0
+            finally:
+                # never return into the test runner from the child
+                os._exit(exitcode)
+        (_, status) = os.waitpid(pid, 0)
+        self.assertEqual(status, 0, "child failed to take the lock")
+
+        (lockpid, _, _) = _read_lockfile(self.path)
+        self.assertEqual(lockpid, pid)
+        self.assertNotEqual(lockpid, os.getpid())
+        self.assertFalse(TimestampedPidLockfile(self.path).i_am_locking())
+
+    def test_acquire_stale_wall_clock(self):
+        """Test that the age of a lock is measured on the wall clock, the same clock that sets its mtime."""
+        now = time.time()
+        with open(self.path, 'w', encoding='utf8') as lockfp:
+            lockfp.write(f"{2**22 + 1}\n{int(now)}\n")
+        os.utime(self.path, (now, now))
+
+        lock = TimestampedPidLockfile(self.path, threshold=60, retry_timeout=0)
+        with mock.patch.object(timestamp_pid_lockfile.time, 'time', return_value=now + 30):
+            self.assertRaises(LockFailed, lock.acquire)
+        with mock.patch.object(timestamp_pid_lockfile.time, 'time', return_value=now + 120):
+            lock.acquire()
+        self.assertTrue(lock.i_am_locking())
+        lock.release()